@@ -23,28 +23,41 @@ BASE_URL = "https://api.routescan.io/v2/network/mainnet/evm/43114/etherscan/api"
 # ---------------- CONFIG ----------------
 BATCHES_PER_RUN = 10     # Keep small to avoid timeouts
 MAX_RESULT_SIZE = 10000  # Etherscan limit
+FLUSH_ROWS = 200_000     # Buffered rows per token before an early write to GCS
+# Ingest already drops refetched txs; keep the global unique(hash) in process.py for raw data written before that
+DEDUP_ON_PROCESS = os.getenv("DEDUP_ON_PROCESS", "1") == "1"
+API_MIN_INTERVAL = 0.201  # Seconds between API calls, shared by all tokens (rate limit)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Buffers above this use chunked resumable GCS uploads
+UPLOAD_WORKERS = 8       # Concurrent GCS uploads per token
+HEATMAP_MAX_MONTHS = 36  # Report heatmap keeps only the most recent months (one row each)
 
 # --- FOLDER PATHS ---
 RAW_FOLDER = "raw_normal_data"
 PROCESSED_FOLDER = "processed_normal_transfers"
 REPORTS_FOLDER = "reports"
 
-# Columns to keep for clean data
-KEEP_COLS = {
-    "blockNumber", "timeStamp", "hash", "from", 
-    "input", "functionName", "methodId", "isError"
-}
+# Columns to keep for clean data, in the order they are written to the raw layer
+KEEP_COLS_ORDERED = (
+    "blockNumber", "timeStamp", "hash", "from", "to", "value",
+    "input", "methodId", "functionName", "month"
+)
 
-DROPCOLS_INGEST = ["nonce", "transactionIndex", "gas", "gasPrice", "gasUsed",
-                   "cumulativeGasUsed", "txreceipt_status", "confirmations", "contractAddress", "isError"]
+# Lowercased once at ingest
+LOWERCASE_COLS = ["hash", "from", "to", "input", "methodId", "functionName"]
+
+# --- METHOD SELECTORS ---
+TRANSFER_METHOD_ID = "0xa9059cbb"       # transfer(address,uint256)
+TRANSFER_FROM_METHOD_ID = "0x23b872dd"  # transferFrom(address,address,uint256)
+APPROVE_METHOD_ID = "0x095ea7b3"        # approve(address,uint256)
 
 # --- TOKEN DEFINITIONS ---
 class TokenDef:
-    def __init__(self, symbol, address, supply,decimals=18):
+    def __init__(self, symbol, address, supply,decimals=18, creation_block=None):
         self.symbol = symbol
         self.address = address.lower()
         self.decimals = decimals
         self.supply = supply
+        self.creation_block = creation_block  # Known genesis block skips the API lookup
 
 TOKENS = [
     TokenDef(symbol="ARENA", address="0xB8d7710f7d8349A506b75dD184F05777c82dAd0C", supply= 10_000_000_000,decimals=18), # Example
@@ -82,7 +95,6 @@ raw normal tx:
 schema after ingestion:
     Schema: OrderedDict([
     ('blockNumber', String), 
-    ('blockHash', String), 
     ('timeStamp', String), 
     ('hash', String), 
     ('from', String), 
@@ -96,7 +108,6 @@ schema after ingestion:
 schema after processing:
 OrderedDict([
 ('blockNumber', Int64), 
-('blockHash', String), 
 ('timeStamp', Int64), 
 ('hash', String), 
 ('from', String), 
@@ -105,6 +116,7 @@ OrderedDict([
 ('input', String), 
 ('methodId', String), 
 ('functionName', String), 
+('date_utc', Date), 
 ('month', String)])
 
 
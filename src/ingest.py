@@ -1,11 +1,15 @@
 import logging
 import sys
-from config import TOKENS, BUCKET_NAME, BATCHES_PER_RUN, MAX_RESULT_SIZE
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import polars as pl
+from config import TOKENS, BUCKET_NAME, BATCHES_PER_RUN, MAX_RESULT_SIZE, FLUSH_ROWS
 from utils import (
     get_gcs_client, 
     load_state, 
     save_state,
     trim_ingestion, 
+    HashDeduper,
     save_buffer,
     fetch_normal_batch, 
     get_chain_tip, 
@@ -20,7 +24,44 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def run_incremental(token, t_state, chain_tip):
+def flush_buffers(buffers: list, symbol: str, prefix: str, deduper: HashDeduper):
+    """Writes the accumulated batch buffers as one set of monthly parquets and empties the list."""
+    if buffers:
+        save_buffer(pl.concat(buffers, how="vertical_relaxed", rechunk=True), symbol, BUCKET_NAME, prefix=prefix)
+        buffers.clear()
+
+    deduper.commit()
+
+def block_bounds(batch: list, sort: str) -> tuple:
+    """
+    (lowest, highest) block of a batch fetched with sort="asc"/"desc", read off its ends.
+    Falls back to a full scan if the ends contradict the requested order.
+    """
+    first, last = int(batch[0]["blockNumber"]), int(batch[-1]["blockNumber"])
+    low, high = (first, last) if sort == "asc" else (last, first)
+    if low <= high:
+        return low, high
+
+    logger.warning(f"API returned a batch out of {sort} order; scanning it for block bounds.")
+    blocks = [int(tx["blockNumber"]) for tx in batch]
+    return min(blocks), max(blocks)
+
+def resolve_creation_block(token, t_state):
+    """
+    The creation block is immutable: use the configured value, then the cached state,
+    and only hit the API when neither is known. Discoveries are cached in t_state.
+    """
+    creation_block = token.creation_block or t_state.get("creation_block", 0)
+
+    if not creation_block:
+        creation_block = get_contract_creation_block(token.address)
+        if creation_block > 0:
+            logger.info(f"{token.symbol}: Creation block found at {creation_block}")
+
+    t_state["creation_block"] = creation_block
+    return creation_block
+
+def run_incremental(token, t_state, chain_tip, deduper):
     """Fetches NEW transactions (Forward from max_ingested)."""
 
     start_block = t_state.get("max_ingested_block", 0) + 1
@@ -31,6 +72,8 @@ def run_incremental(token, t_state, chain_tip):
     
     total_docs = 0
     current_start = start_block
+    buffers = []
+    pending = {}  # Cursor moves only reach t_state once their batches are flushed to GCS
     
     for _ in range(BATCHES_PER_RUN):
         logger.info(f"{token.symbol} [Inc]: Fetching batch from block {current_start} to {chain_tip}")
@@ -40,19 +83,26 @@ def run_incremental(token, t_state, chain_tip):
         if not batch:
             break
         
-        buffer = trim_ingestion(batch)
+        # Overlapping boundary blocks are refetched on purpose; drop the txs we already hold
+        fresh = deduper.filter(batch)
+        buffer = trim_ingestion(fresh)
 
-        if buffer is None:
+        if buffer is None and fresh:
             logger.info("Buffer empty after trimming. Ending incremental.")
             break
         
-        save_buffer(buffer, token.symbol, BUCKET_NAME, prefix="inc")
+        if buffer is not None:
+            buffers.append(buffer)
         del buffer
 
         total_docs += len(batch)
         
-        max_block_in_batch = max(int(t["blockNumber"]) for t in batch)
-        t_state["max_ingested_block"] = max_block_in_batch
+        _, max_block_in_batch = block_bounds(batch, "asc")
+        pending["max_ingested_block"] = max_block_in_batch
+
+        if sum(len(b) for b in buffers) >= FLUSH_ROWS:
+            flush_buffers(buffers, token.symbol, prefix="inc", deduper=deduper)
+            t_state.update(pending)
         
         if len(batch) < MAX_RESULT_SIZE:
             break
@@ -68,16 +118,18 @@ def run_incremental(token, t_state, chain_tip):
         # Safety: If we passed the tip
         if current_start > chain_tip:
             break
+
+    flush_buffers(buffers, token.symbol, prefix="inc", deduper=deduper)
+    t_state.update(pending)
             
     if total_docs > 0:
         logger.info(f"{token.symbol} [Inc]: Ingested {total_docs} txs. New Head: {t_state['max_ingested_block']}")
 
 
-def run_token_init(token, t_state, chain_tip):
+def run_token_init(token, t_state, chain_tip, deduper):
     """Bootstraps a completely new token with its first 10k recent transactions."""
     
-    creation_block = get_contract_creation_block(token.address)
-    t_state["creation_block"] = creation_block
+    creation_block = resolve_creation_block(token, t_state)
 
     logger.info(f"--- INITIALIZING {token.symbol} ---")
     logger.info(f"{token.symbol} [Init]: Fetching 10,000 most recent transactions...")
@@ -86,14 +138,14 @@ def run_token_init(token, t_state, chain_tip):
     batch = fetch_normal_batch(token.address, 0, chain_tip, "desc")
     
     if batch:
-        buffer = trim_ingestion(batch)
+        buffer = trim_ingestion(deduper.filter(batch))
         if buffer is not None:
             save_buffer(buffer, token.symbol, BUCKET_NAME, prefix="init")
             del buffer
+        deduper.commit()
         
         # Establish Cursors
-        t_state["max_ingested_block"] = max(int(t["blockNumber"]) for t in batch)
-        min_b = min(int(t["blockNumber"]) for t in batch)
+        min_b, t_state["max_ingested_block"] = block_bounds(batch, "desc")
         t_state["min_ingested_block"] = min_b
         
         # Check if we hit the bottom immediately
@@ -102,27 +154,27 @@ def run_token_init(token, t_state, chain_tip):
             
         t_state["initialized"] = True
         logger.info(f"{token.symbol} [Init]: Success! Head: {t_state['max_ingested_block']}, Floor: {t_state['min_ingested_block']}")
+
+        # A full page means older history remains: keep walking back in this run instead of waiting for the next one
+        if len(batch) == MAX_RESULT_SIZE and min_b > creation_block:
+            try:
+                run_backfill(token, t_state, deduper)
+            except Exception as e:
+                logger.error(f"{token.symbol} [Init]: Backfill after init failed: {e}")
+                deduper.rollback()
     else:
         logger.warning(f"{token.symbol} [Init]: No transactions found. Marking initialized to prevent infinite loops.")
         t_state["initialized"] = True
 
 
-def run_backfill(token, t_state):
+def run_backfill(token, t_state, deduper):
     """Fetches OLD transactions (Backward from min_ingested)."""
     
     if t_state.get("history_status") == "filled":
         return
 
     # FIX: Must define creation_block before checking it
-    creation_block = t_state.get("creation_block", 0)
-    
-    if creation_block == 0:
-        creation_block = get_contract_creation_block(token.address)
-        if creation_block > 0:
-            t_state["creation_block"] = creation_block
-            logger.info(f"{token.symbol}: Creation block found at {creation_block}")
-        else:
-            creation_block = 0 
+    creation_block = resolve_creation_block(token, t_state)
 
     current_floor = t_state.get("min_ingested_block", 0)
     
@@ -135,6 +187,8 @@ def run_backfill(token, t_state):
     logger.info(f"{token.symbol} [Backfill]: Walking back from {current_floor} (Target: {creation_block})")
 
     total_docs = 0
+    buffers = []
+    pending = {}  # Cursor moves only reach t_state once their batches are flushed to GCS
     
     for _ in range(BATCHES_PER_RUN):
         target_start = creation_block if creation_block > 0 else 0
@@ -145,27 +199,34 @@ def run_backfill(token, t_state):
         
         if not batch:
             if target_start > 0:
-                t_state["history_status"] = "filled"
-                t_state["min_ingested_block"] = target_start
+                pending["history_status"] = "filled"
+                pending["min_ingested_block"] = target_start
                 logger.info(f"{token.symbol} [Backfill]: No data returned. Marking filled.")
             break
             
-        buffer = trim_ingestion(batch)
-        if buffer is None:
+        # Overlapping boundary blocks are refetched on purpose; drop the txs we already hold
+        fresh = deduper.filter(batch)
+        buffer = trim_ingestion(fresh)
+        if buffer is None and fresh:
             logger.info("Buffer empty after trimming. Ending backfill.")
             break
             
-        save_buffer(buffer, token.symbol, BUCKET_NAME, prefix="bf")
+        if buffer is not None:
+            buffers.append(buffer)
         del buffer
 
         total_docs += len(batch)
         
-        min_block_in_batch = min(int(t["blockNumber"]) for t in batch)
-        t_state["min_ingested_block"] = min_block_in_batch 
+        min_block_in_batch, _ = block_bounds(batch, "desc")
+        pending["min_ingested_block"] = min_block_in_batch 
+
+        if sum(len(b) for b in buffers) >= FLUSH_ROWS:
+            flush_buffers(buffers, token.symbol, prefix="bf", deduper=deduper)
+            t_state.update(pending)
         
         if len(batch) < MAX_RESULT_SIZE:
-            t_state["history_status"] = "filled"
-            t_state["min_ingested_block"] = creation_block
+            pending["history_status"] = "filled"
+            pending["min_ingested_block"] = creation_block
             logger.info(f"{token.symbol} [Backfill]: Partial page received. History finished.")
             break
             
@@ -178,17 +239,74 @@ def run_backfill(token, t_state):
             next_floor = min_block_in_batch
             
         if next_floor <= creation_block and creation_block > 0:
-            t_state["history_status"] = "filled"
-            t_state["min_ingested_block"] = creation_block
+            pending["history_status"] = "filled"
+            pending["min_ingested_block"] = creation_block
             logger.info(f"{token.symbol} [Backfill]: Crossed creation block. History finished.")
             break
             
         current_floor = next_floor
 
+    flush_buffers(buffers, token.symbol, prefix="bf", deduper=deduper)
+    t_state.update(pending)
+
     if total_docs > 0:
         logger.info(f"{token.symbol} [Backfill]: Saved {total_docs} txs. New Floor: {t_state['min_ingested_block']}")
 
 
+def remember_floor_hashes(t_state, deduper):
+    """
+    Incremental runs restart above the head, so only the backfill floor block is refetched by a later run:
+    its hashes are the only ones worth keeping in state.
+    """
+    floor = t_state.get("min_ingested_block", 0)
+    t_state.pop("recent_hashes", None)  # Replaced by floor_hashes
+    t_state["floor_hashes"] = {"block": floor, "hashes": deduper.hashes_at(floor)}
+
+
+def commit_token_state(token, t_state, state, bucket, state_lock):
+    """Merges one token's cursor into the global state and persists it."""
+    with state_lock:
+        state["tokens"][token.symbol] = dict(t_state)
+        save_state(bucket, state)
+
+
+def run_token(token, state, bucket, chain_tip, state_lock):
+    """Runs Init or Incremental + Backfill for one token on a private copy of its state."""
+    with state_lock:
+        t_state = dict(state["tokens"][token.symbol])
+
+    # Hashes persisted from previous runs catch the backfill floor block being refetched
+    floor = t_state.get("floor_hashes", {})
+    deduper = HashDeduper(floor.get("hashes", []), floor.get("block"))
+
+    # --- INITIALIZATION PHASE ---
+    if not t_state.get("initialized", False):
+        try:
+            run_token_init(token, t_state, chain_tip, deduper)
+            remember_floor_hashes(t_state, deduper)
+            commit_token_state(token, t_state, state, bucket, state_lock)  # Save after init
+        except Exception as e:
+            logger.error(f"Initialization failed for {token.symbol}: {e}")
+        return
+
+    # --- NORMAL INGESTION PHASE ---
+    try:
+        run_incremental(token, t_state, chain_tip, deduper)
+    except Exception as e:
+        logger.error(f"Incremental failed for {token.symbol}: {e}")
+        deduper.rollback()
+
+    try:
+        # FIX: Removed chain_tip to match function signature
+        run_backfill(token, t_state, deduper) 
+    except Exception as e:
+        logger.error(f"Backfill failed for {token.symbol}: {e}")
+        deduper.rollback()
+
+    remember_floor_hashes(t_state, deduper)
+    commit_token_state(token, t_state, state, bucket, state_lock)
+
+
 def main():
     print("--- PIPELINE STARTING ---")
     
@@ -213,31 +331,11 @@ def main():
                 "history_status": "unfilled",
                 "creation_block": 0
             }
-        
-        t_state = state["tokens"][token.symbol]
-        
-        # --- INITIALIZATION PHASE ---
-        if not t_state.get("initialized", False):
-            try:
-                run_token_init(token, t_state, chain_tip)
-                save_state(bucket, state)  # Save after init
-            except Exception as e:
-                logger.error(f"Initialization failed for {token.symbol}: {e}")
-                continue  # Skip to next token if init fails
-        else:
-            # --- NORMAL INGESTION PHASE ---
-            try:
-                run_incremental(token, t_state, chain_tip)
-            except Exception as e:
-                logger.error(f"Incremental failed for {token.symbol}: {e}")
-
-            try:
-                # FIX: Removed chain_tip to match function signature
-                run_backfill(token, t_state) 
-            except Exception as e:
-                logger.error(f"Backfill failed for {token.symbol}: {e}")
 
-            save_state(bucket, state)
+    # Tokens overlap their API waits; the shared rate limiter in utils keeps the total request rate in check
+    state_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=len(TOKENS)) as pool:
+        list(pool.map(lambda token: run_token(token, state, bucket, chain_tip, state_lock), TOKENS))
 
     print("--- PIPELINE FINISHED ---")
 
@@ -1,11 +1,12 @@
-import os
+import io
 import sys
 import logging
 import json
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 import polars as pl
-from google.cloud import storage
-from config import TOKENS, BUCKET_NAME, RAW_FOLDER
-from utils import decode_row, extract_field
+from config import TOKENS, BUCKET_NAME, RAW_FOLDER, KEEP_COLS_ORDERED, UPLOAD_WORKERS, DEDUP_ON_PROCESS, TRANSFER_METHOD_ID, TRANSFER_FROM_METHOD_ID
+from utils import decode_row, abi_word_address, abi_word_float, upload_buffer, get_gcs_client, run_per_token
 
 # ---------------- LOGGING ----------------
 logging.basicConfig(
@@ -15,160 +16,150 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Raw columns carried through processing ('blockHash' from older files and the raw 'month' are never read back)
+RAW_COLS = [c for c in KEEP_COLS_ORDERED if c != "month"]
+
+def save_month_partition(bucket, folder_name: str, symbol: str, month: date, part_df: pl.DataFrame):
+    """Writes one month partition to {folder_name}/token=SYMBOL/month=YYYY-MM/data.parquet."""
+    # 'month' is kept as a Date while processing; format it once per partition, not per row
+    month_str = month.strftime("%Y-%m")
+    part_df = part_df.with_columns(pl.lit(month_str).alias("month"))
+
+    filename = "data.parquet"
+    blob_path = f"{folder_name}/token={symbol}/month={month_str}/{filename}"
+
+    buf = io.BytesIO()
+    part_df.write_parquet(buf, compression="zstd", compression_level=3, statistics=True, use_pyarrow=False)
+    upload_buffer(bucket, blob_path, buf)
+
 def token_processor(token_def):
     """
     1. Clean
-    2. Decode inputs to JSON string
-    3. Overwrite transfer parameters
-    4. Split into Transfers vs Non-Transfers
-    5. Save to Google Cloud Storage
+    2. Decode transfer inputs & overwrite transfer parameters
+    3. Split into Transfers vs Non-Transfers
+    4. Save to Google Cloud Storage
     """
     symbol = token_def.symbol
     decimals = token_def.decimals
 
     logger.info(f"--- Processing Data for {symbol} ---")
 
-    # 1 --- Clean & Prepare DataFrame ---
+    # 1 --- Clean & Prepare LazyFrame ---
     try:
         raw_glob_path = f"gs://{BUCKET_NAME}/{RAW_FOLDER}/token={symbol}/**/*.parquet"
         logger.info(f"Scanning path: {raw_glob_path}")
 
         # hive_partitioning=False prevents crashes from messy Google Cloud Storage directory trees
-        lf = pl.scan_parquet(raw_glob_path, hive_partitioning=False)
+        lf = pl.scan_parquet(raw_glob_path, hive_partitioning=False, low_memory=False)
 
     except Exception as e:
         logger.warning(f"Error Loading for {symbol}: {e}")
         return
 
-    # Collect Entire DataFrame and Deduplicate
+    # Project only the columns we export (pushed down to the Parquet reader) and Deduplicate
+    lf = lf.select(RAW_COLS)
+    if DEDUP_ON_PROCESS:
+        lf = lf.unique(subset=["hash"], keep="first")
+
+    # Column Datatypes casting & Date Generation
+    # Hex & name columns arrive lowercased from ingest (utils.trim_ingestion)
+    lf = lf.with_columns([
+        pl.col("blockNumber").cast(pl.Int64),
+        pl.col("timeStamp").cast(pl.Int64),
+        pl.col("value").cast(pl.Float64),
+    ])
+
+    # Derive the UTC date once and persist it, so downstream layers never re-parse timeStamp.
+    # 'month' is re-derived from it since hive_partitioning=False ignores the folder names
+    lf = lf.with_columns(
+        pl.from_epoch(pl.col("timeStamp"), time_unit="s").dt.date().alias("date_utc")
+    ).with_columns(
+        pl.col("date_utc").dt.truncate("1mo").alias("month")
+    )
+
+
+    # 2 --- DECODE & OVERWRITE TRANSFER COLUMNS ---
+    # Only match the exact transfer or transferFrom selectors
+    is_transfer = pl.col("methodId") == TRANSFER_METHOD_ID
+    is_transfer_from = pl.col("methodId") == TRANSFER_FROM_METHOD_ID
+    is_transfer_condition = pl.col("methodId").is_in([TRANSFER_METHOD_ID, TRANSFER_FROM_METHOD_ID])
+
+    # Rename original transaction sender to 'caller'
+    lf = lf.rename({"from": "caller"})
+
+    # Fixed ABI layout: slice the 32-byte words straight out of the hex input
+    decoded_from = pl.when(is_transfer_from).then(abi_word_address("input", 0))
+    decoded_to = (
+        pl.when(is_transfer).then(abi_word_address("input", 0))
+        .when(is_transfer_from).then(abi_word_address("input", 1))
+    )
+    decoded_value = (
+        pl.when(is_transfer).then(abi_word_float("input", 1))
+        .when(is_transfer_from).then(abi_word_float("input", 2))
+    )
+
+    lf = lf.with_columns([
+        # FROM LOGIC: Use decoded from if available (transferFrom). Otherwise use caller (transfer & non-transfers).
+        pl.coalesce([decoded_from, pl.col("caller")]).alias("from"),
+
+        # TO LOGIC: Use decoded to if available. Otherwise keep the original 'to' (contract address).
+        pl.coalesce([decoded_to, pl.col("to")]).alias("to"),
+
+        # VALUE LOGIC: Normalize decoded value. Otherwise keep original native value.
+        pl.coalesce([decoded_value / (10 ** decimals), pl.col("value")]).alias("value"),
+    ])
+
+
+    # 3 --- SPLIT DATASET ---
+    # Collect the decoded frame once (collect_all would scan and dedup the raw layer per branch),
+    # then split it eagerly. Sorting by timeStamp makes every month a contiguous slice for partition_by.
+    logger.info("Decoding transfer inputs & splitting dataset...")
     try:
-        df = lf.collect()
-        if df.is_empty():
-            logger.info(f"No successful transactions for {symbol}.")
-            return
-        
-        df = df.unique(subset=["hash"], keep="first")
-        logger.info(f"Loaded {len(df)} rows for processing")
+        df = lf.sort("timeStamp").collect()
     except Exception as e:
         logger.error(f"Failed collecting dataframe: {e}")
         return
 
-    # Column Datatypes casting & Date Generation
-    try:
-        df = df.with_columns([
-            pl.col("blockNumber").cast(pl.Int64),
-            pl.col("timeStamp").cast(pl.Int64),
-            pl.col("hash").str.to_lowercase(),
-            pl.col("from").str.to_lowercase(),
-            pl.col("to").str.to_lowercase(),
-            pl.col("value").cast(pl.Float64),
-            pl.col("input").str.to_lowercase(),
-            pl.col("methodId").str.to_lowercase(),
-            pl.col("functionName").str.to_lowercase(),
-        ])
-        
-        # Re-derive 'month' from timeStamp since hive_partitioning=False ignores the folder names
-        df = df.with_columns(
-            pl.from_epoch(pl.col("timeStamp"), time_unit="s")
-            .dt.strftime("%Y-%m")
-            .alias("month")
-        )
+    transfers_df = df.filter(is_transfer_condition).drop(['functionName','methodId','input'])
+    notransfers_df = df.filter(~is_transfer_condition)
+    methodid_unique_df = df.unique(subset=["methodId"], keep="first").select(['functionName','hash','methodId','input'])
+    del df
 
-    except Exception as e:
-        logger.error(f"Column preparation failed: {e}")
+    if transfers_df.is_empty() and notransfers_df.is_empty():
+        logger.info(f"No successful transactions for {symbol}.")
         return
 
+    logger.info(f"Loaded {len(transfers_df) + len(notransfers_df)} rows for processing")
+
+    datasets = {
+        "processed_normal_transfers": transfers_df,
+        "processed_normal_txs_notransfers": notransfers_df
+    }
+
+    # Save samples to Google Cloud Storage
+    bucket = get_gcs_client().bucket(BUCKET_NAME)
 
-    # 2 --- DECODING DataFrame ---
-    logger.info("Decoding smart contract inputs...")
     try:
-        # We dump the dict to a JSON string because Polars Structs require a uniform schema
-        df = df.with_columns(
+        # Generic decoding only runs on one row per methodId
+        methodid_unique_df = methodid_unique_df.with_columns(
             pl.struct(["input", "functionName"])
             .map_elements(
-                lambda r: json.dumps(decode_row(r["input"], r["functionName"])), 
+                lambda r: json.dumps(decode_row(r["input"], r["functionName"])),
                 return_dtype=pl.Utf8
             )
             .alias("decoded_params")
         )
-    except Exception as e:
-        logger.error(f"Decoding failed: {e}")
-        return
-
-
-    # 3 --- OVERWRITE TRANSFER COLUMNS ---
-    # Only match exact transfer or transferfrom signatures
-    is_transfer_condition = (
-        pl.col("functionName").str.starts_with("transfer(") |
-        pl.col("functionName").str.starts_with("transferfrom(")
-    )
-    # Rename original transaction sender to 'caller'
-    df = df.rename({"from": "caller"})
-
-    logger.info("Overwriting decoded parameters for transfers...")
-    try:
-        # Extract fields temporarily
-        df = df.with_columns([
-            pl.col("decoded_params").map_elements(lambda x: extract_field(x, "to"), return_dtype=pl.Utf8).alias("decoded_to"),
-            pl.col("decoded_params").map_elements(lambda x: extract_field(x, "from"), return_dtype=pl.Utf8).alias("decoded_from"),
-            pl.col("decoded_params").map_elements(lambda x: extract_field(x, "value", "amount"), return_dtype=pl.Float64).alias("decoded_value")
-        ])
-
-        # Overwrite logic
-        df = df.with_columns([
-            # FROM LOGIC: Use decoded_from if available (transferFrom). Otherwise use caller (transfer).
-            pl.when(is_transfer_condition & pl.col("decoded_from").is_not_null())
-              .then(pl.col("decoded_from").str.to_lowercase())
-              .when(is_transfer_condition)
-              .then(pl.col("caller"))
-              .otherwise(pl.col("caller")) # Fallback for non-transfers
-              .alias("from"),
-              
-            # TO LOGIC: Use decoded_to if available. Otherwise keep the original 'to' (contract address).
-            pl.when(is_transfer_condition & pl.col("decoded_to").is_not_null())
-              .then(pl.col("decoded_to").str.to_lowercase())
-              .otherwise(pl.col("to"))
-              .alias("to"),
-              
-            # VALUE LOGIC: Normalize decoded value. Otherwise keep original native value.
-            pl.when(is_transfer_condition & pl.col("decoded_value").is_not_null())
-              .then(pl.col("decoded_value") / (10 ** decimals))
-              .otherwise(pl.col("value"))
-              .alias("value")
-        ]).drop(["decoded_to", "decoded_from", "decoded_value"])
-        
-    except Exception as e:
-        logger.error(f"Failed to overwrite transfer columns: {e}")
-        return
-
-    # Save samples to Google Cloud Storage
-    client = storage.Client()
-    bucket = client.bucket(BUCKET_NAME)
-
-    try:
-        methodid_unique_df = df.unique(subset=["methodId"], keep="first")
         methodid_unique_df = methodid_unique_df.select(['functionName','decoded_params','hash','methodId','input'])
 
-        sample_local_path = f"/tmp/{symbol}_method_sample.csv"
         sample_blob_path = f"samples/token={symbol}/methodid_unique_sample.csv"
-    
-        methodid_unique_df.write_csv(sample_local_path)
-        bucket.blob(sample_blob_path).upload_from_filename(sample_local_path)
-        os.remove(sample_local_path)
+        bucket.blob(sample_blob_path).upload_from_string(methodid_unique_df.write_csv(), content_type="text/csv")
         
         logger.info(f"Sample [methodId] Saved -> gs://{BUCKET_NAME}/{sample_blob_path}")
     except Exception as e:
         logger.warning(f"Could not generate sample CSV for {symbol}: {e}")
-
-    # 4 --- SPLIT DATASET ---
-    datasets = {
-        "processed_normal_transfers": df.filter(is_transfer_condition).drop(['decoded_params','functionName','methodId','input']),
-        "processed_normal_txs_notransfers": df.filter(~is_transfer_condition)
-    }
     
 
-    # 5 --- EXPORT TO GOOGLE CLOUD STORAGE ---
-    logger.info(f"{symbol} | Splitting dataset into Transfers vs Non-Transfers...")
+    # 4 --- EXPORT TO GOOGLE CLOUD STORAGE ---
     logger.info(f"Schema: {datasets['processed_normal_transfers'].schema}")
 
     for folder_name, target_df in datasets.items():
@@ -178,38 +169,32 @@ def token_processor(token_def):
             
         logger.info(f"Saving {len(target_df)} rows to {folder_name}...")
                     
-        for part_df in target_df.partition_by("month"):
-            month_str = part_df["month"][0]
-            if month_str is None:
-                continue
-            
-            filename = "data.parquet"
-            blob_path = f"{folder_name}/token={symbol}/month={month_str}/{filename}"
-            local_path = f"/tmp/{symbol}_{month_str}_{folder_name}.parquet"
-            
-            part_df.write_parquet(local_path)
-            blob = bucket.blob(blob_path)
-            blob.upload_from_filename(local_path)
-            os.remove(local_path)
+        # Uploads are network-bound, so months go up concurrently
+        parts = target_df.filter(pl.col("month").is_not_null()).partition_by("month", maintain_order=True, as_dict=True, include_key=True)
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+            list(pool.map(
+                lambda item: save_month_partition(bucket, folder_name, symbol, *item),
+                parts.items()
+            ))
 
     # Export processed_normal_transfers as JSON
     try:
         if not datasets['processed_normal_transfers'].is_empty():
-            json_local_path = f"/tmp/{symbol}_transfers.json"
             json_blob_path = f"processed_transfers_json/{symbol}_transfers.json"
-            
-            datasets['processed_normal_transfers'].write_json(json_local_path)
-            blob = bucket.blob(json_blob_path)
-            blob.upload_from_filename(json_local_path)
-            os.remove(json_local_path)
+
+            buf = io.BytesIO()
+            datasets['processed_normal_transfers'].with_columns(
+                pl.col("month").dt.strftime("%Y-%m")
+            ).write_json(buf)
+            upload_buffer(bucket, json_blob_path, buf, content_type="application/json")
             
             logger.info(f"Transfers JSON saved -> gs://{BUCKET_NAME}/{json_blob_path}")
     except Exception as e:
         logger.warning(f"Could not save transfers JSON for {symbol}: {e}")
 
 def main():
+    run_per_token(token_processor, TOKENS)
     for token in TOKENS:
-        token_processor(token)
         logger.info(f"Processed {token.symbol}.")
 
 
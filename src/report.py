@@ -1,11 +1,13 @@
+import io
 import sys
+import gzip
 import logging
+from functools import partial
 import polars as pl
 import plotly.graph_objects as go
 import plotly.express as px
-import plotly.io as pio
-from google.cloud import storage
-from config import TOKENS, BUCKET_NAME, REPORTS_FOLDER
+from config import TOKENS, BUCKET_NAME, PROCESSED_FOLDER, REPORTS_FOLDER, HEATMAP_MAX_MONTHS
+from utils import get_gcs_client, run_per_token, PLOTLY_CDN
 
 # ---------------- LOGGING ----------------
 logging.basicConfig(
@@ -15,6 +17,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Pre-minified stylesheet, inlined into every report
+REPORT_CSS = (
+    "body{margin:0;font-family:Inter,-apple-system,sans-serif;background-color:#292929;background-image:radial-gradient(#6c4d4d 1px,transparent 0);background-size:20px 20px;color:#fff;min-height:100vh}"
+    ".app{padding:2rem;max-width:1400px;margin:0 auto}"
+    ".title{text-align:center;font-size:2rem;margin-bottom:2rem;color:#fff}"
+    ".subtitle{text-align:center;font-size:1rem;color:#aaa;margin-bottom:2rem}"
+    ".grid{display:grid;grid-template-columns:repeat(auto-fit,minmax(250px,1fr));gap:2rem;margin-bottom:2rem}"
+    ".grid-2{display:grid;grid-template-columns:repeat(auto-fit,minmax(500px,1fr));gap:2rem;margin-bottom:2rem}"
+    ".card{background-color:#3a3a3a;border:2px solid #444;border-radius:12px;padding:1.5rem;display:flex;flex-direction:column;align-items:center;justify-content:center;transition:transform 0.2s ease,border-color 0.2s ease}"
+    ".card:hover{border-color:#f77;transform:scale(1.02)}"
+    ".stat-label{font-size:1rem;color:#aaa;text-transform:uppercase;margin-bottom:0.5rem;text-align:center}"
+    ".stat-value{font-size:2.2rem;color:#f88;font-weight:bold;text-align:center}"
+    ".chart-wrapper{background-color:#3a3a3a;border:2px solid #444;border-radius:12px;padding:1rem;margin-bottom:2rem}"
+    ".table-wrapper{height:500px;overflow-y:auto;background-color:#3a3a3a;border:2px solid #444;border-radius:12px;padding:1rem;margin-bottom:2rem}"
+    "table{width:100%;border-collapse:collapse;text-align:left}"
+    "th{padding:12px;border-bottom:2px solid #666;color:#f88;position:sticky;top:0;background:#3a3a3a;z-index:10}"
+    "td{padding:12px;border-bottom:1px solid #444;color:#ddd}"
+    "::-webkit-scrollbar{width:8px;height:8px}"
+    "::-webkit-scrollbar-track{background:#292929;border-radius:4px}"
+    "::-webkit-scrollbar-thumb{background:#555;border-radius:4px}"
+    "::-webkit-scrollbar-thumb:hover{background:#f88}"
+)
+
+
+def plotly_div(fig, div_id: str) -> str:
+    """Renders a figure as a div and an inline Plotly.newPlot(id, data, layout, config) call."""
+    # With a figure object as the 2nd argument plotly.js ignores the 3rd, so data/layout are passed separately
+    return (
+        f'<div id="{div_id}"></div><script>(function() {{ var fig = {fig.to_json()}; '
+        f'Plotly.newPlot("{div_id}", fig.data, fig.layout, {{"responsive": true}}); }})();</script>'
+    )
+
+
+def month_label(col: str = "month_key") -> pl.Expr:
+    """Formats a packed year*12+(month-1) key as 'YYYY-MM'."""
+    return pl.format(
+        "{}-{}",
+        pl.col(col) // 12,
+        (pl.col(col) % 12 + 1).cast(pl.Utf8).str.zfill(2),
+    ).alias("month_str")
+
 
 def polars_to_html_table(df: pl.DataFrame) -> str:
     if df.is_empty():
@@ -26,104 +69,172 @@ def polars_to_html_table(df: pl.DataFrame) -> str:
         df = df.with_columns([pl.col(c).round(2) for c in float_cols])
 
     headers = "".join(f"<th>{col}</th>" for col in df.columns)
-    rows = []
 
-    for row in df.iter_rows():
-        cells = "".join(f"<td>{str(val)}</td>" for val in row)
-        rows.append(f"<tr>{cells}</tr>")
+    # Build every <tr> in Polars; Python only joins the finished row strings
+    rows = df.select(
+        pl.concat_str(
+            [pl.lit("<tr>")]
+            + [pl.lit("<td>") + pl.col(c).cast(pl.Utf8).fill_null("") + pl.lit("</td>") for c in df.columns]
+            + [pl.lit("</tr>")]
+        ).alias("row")
+    )["row"]
 
     return f"""
     <table>
         <thead><tr>{headers}</tr></thead>
-        <tbody>{"".join(rows)}</tbody>
+        <tbody>{"".join(rows.to_list())}</tbody>
     </table>
     """
 
 
-def generate_eda_report(token_symbol: str):
+def report_is_fresh(bucket, token_symbol: str, blob_name: str) -> bool:
+    """True when the report blob is newer than every processed transfers parquet for the token."""
+    report_blob = bucket.get_blob(blob_name)
+    if report_blob is None:
+        return False
+
+    source_blobs = bucket.list_blobs(prefix=f"{PROCESSED_FOLDER}/token={token_symbol}/")
+    latest_source = max((b.updated for b in source_blobs), default=None)
+    return latest_source is not None and report_blob.updated > latest_source
+
+
+def generate_eda_report(token_symbol: str, force: bool = False):
+    bucket = get_gcs_client().bucket(BUCKET_NAME)
+    blob_name = f"{REPORTS_FOLDER}/{token_symbol}_transfers_eda.html"
+
+    if not force:
+        try:
+            if report_is_fresh(bucket, token_symbol, blob_name):
+                logger.info(f"Report for {token_symbol} is up to date, skipping.")
+                return
+        except Exception as e:
+            logger.warning(f"Could not check report freshness for {token_symbol}: {e}")
+
     logger.info(f"Generating Visual Analytics Report for {token_symbol}...")
 
     # 1. Native Polars Scanning targeting ONLY transfers in Google Cloud Storage
     path_glob = f"gs://{BUCKET_NAME}/processed_normal_transfers/token={token_symbol}/**/*.parquet"
     
     try:
-        lf = pl.scan_parquet(path_glob, hive_partitioning=False)
-
-        # Collect necessary columns
+        # Only the columns the report reads; the select is pushed down into the Parquet reader.
+        # Everything is aggregated straight away, so skip rechunking/caching and favour throughput over memory
+        lf = pl.scan_parquet(
+            path_glob, hive_partitioning=False, rechunk=False, low_memory=False, cache=False
+        ).select(["timeStamp", "caller", "from", "to", "value"])
+
+        # Collect necessary columns from a single Datetime; months are grouped on an integer key
+        # and only formatted as 'YYYY-MM' once aggregated (see month_label)
+        ts = pl.from_epoch(pl.col("timeStamp"), time_unit="s")
         lf = lf.with_columns([
-            pl.from_epoch(pl.col("timeStamp"), time_unit="s").dt.date().alias("date_utc"),
-            pl.from_epoch(pl.col("timeStamp"), time_unit="s").dt.strftime("%Y-%m").alias("month_str"),
-            pl.from_epoch(pl.col("timeStamp"), time_unit="s").dt.day().cast(pl.Utf8).alias("day_of_month")
+            ts.dt.date().alias("date_utc"),
+            (ts.dt.year().cast(pl.Int32) * 12 + ts.dt.month().cast(pl.Int32) - 1).alias("month_key"),
+            ts.dt.day().cast(pl.Int8).alias("day_of_month")
         ])
 
-        df = lf.collect()
+        # Address strings are hashed once to UInt64; all address-keyed aggregations use the hashes
+        lf = lf.with_columns([
+            pl.col("caller").hash().alias("caller_h"),
+            pl.col("from").hash().alias("from_h"),
+            pl.col("to").hash().alias("to_h"),
+        ])
 
-        if df.is_empty():
-            logger.warning(f"No transfer data found for {token_symbol}.")
-            return
+        # collect_all plans each LazyFrame separately, so materialise the projected base once
+        # and run every aggregate below lazily over the in-memory frame
+        lf = lf.collect().lazy()
 
     except Exception as e:
         logger.error(f"Error loading data for {token_symbol}: {e}")
         return
 
-    # ---------------- GLOBAL STATS ----------------
-    min_date = df["date_utc"].min()
-    max_date = df["date_utc"].max()
-    total_txs = len(df)
-
-    u_caller = df["caller"].n_unique()
-    u_from = df["from"].n_unique()
-    u_to = df["to"].n_unique()
+    # Every aggregate below is a LazyFrame over the same in-memory base; collect_all runs them in parallel
 
-    min_val = df["value"].min()
-    max_val = df["value"].max()
-    mean_val = df["value"].mean()
-    median_val = df["value"].median()
+    # ---------------- GLOBAL STATS ----------------
+    lf_global = lf.select([
+        pl.col("date_utc").min().alias("min_date"),
+        pl.col("date_utc").max().alias("max_date"),
+        pl.len().alias("total_txs"),
+        pl.col("caller_h").n_unique().alias("u_caller"),
+        pl.col("from_h").n_unique().alias("u_from"),
+        pl.col("to_h").n_unique().alias("u_to"),
+        pl.col("value").min().alias("min_val"),
+        pl.col("value").max().alias("max_val"),
+        pl.col("value").mean().alias("mean_val"),
+        pl.col("value").median().alias("median_val"),
+    ])
 
     # ---------------- LEADERBOARD ----------------
-    addresses_df = pl.concat([
-        df.select(pl.col("from").alias("address")),
-        df.select(pl.col("to").alias("address"))
-    ])
-    
-    top_50_addresses = (
-        addresses_df.group_by("address")
-        .len()
+    # Count each side separately and merge the (much smaller) per-address counts,
+    # instead of stacking the full from/to columns into one.
+    # Group on the hash; the address string is only carried along for display
+    cnt_from = lf.group_by("from_h").agg([pl.col("from").first().alias("address"), pl.len()]).rename({"from_h": "address_h"})
+    cnt_to = lf.group_by("to_h").agg([pl.col("to").first().alias("address"), pl.len()]).rename({"to_h": "address_h"})
+
+    lf_leaderboard = (
+        pl.concat([cnt_from, cnt_to])
+        .group_by("address_h")
+        .agg([pl.col("address").first(), pl.col("len").sum()])
         .sort("len", descending=True)
         .head(100)
-        .rename({"len": "Transfer Count"})
+        .select(["address", pl.col("len").alias("Transfer Count")])
     )
 
     # ---------------- TRUE CUMULATIVE UNIQUES LOGIC ----------------
-    new_callers = df.group_by("caller").agg(pl.col("month_str").min().alias("month_str")).group_by("month_str").len().rename({"len": "new_callers"})
-    new_senders = df.group_by("from").agg(pl.col("month_str").min().alias("month_str")).group_by("month_str").len().rename({"len": "new_senders"})
-    new_receivers = df.group_by("to").agg(pl.col("month_str").min().alias("month_str")).group_by("month_str").len().rename({"len": "new_receivers"})
+    new_callers = lf.group_by("caller_h").agg(pl.col("month_key").min().alias("month_key")).group_by("month_key").len().rename({"len": "new_callers"})
+    new_senders = lf.group_by("from_h").agg(pl.col("month_key").min().alias("month_key")).group_by("month_key").len().rename({"len": "new_senders"})
+    new_receivers = lf.group_by("to_h").agg(pl.col("month_key").min().alias("month_key")).group_by("month_key").len().rename({"len": "new_receivers"})
 
     # ---------------- MONTHLY AGGREGATION ----------------
-    monthly_aggs = (
-        df.group_by("month_str")
+    # Active participants per month use HyperLogLog (approx_n_unique, ~1% relative error);
+    # the global unique cards above stay exact
+    lf_monthly = (
+        lf.group_by("month_key")
         .agg([
             pl.len().alias("tx_count"),
             pl.col("value").sum().alias("total_volume"),
             pl.col("value").mean().alias("avg_transfer_size"),
             pl.col("value").median().alias("med_transfer_size"),
-            pl.col("caller").n_unique().alias("active_callers"),
-            pl.col("from").n_unique().alias("active_senders"),
-            pl.col("to").n_unique().alias("active_receivers"),
+            pl.col("caller_h").approx_n_unique().alias("active_callers"),
+            pl.col("from_h").approx_n_unique().alias("active_senders"),
+            pl.col("to_h").approx_n_unique().alias("active_receivers"),
         ])
-        .join(new_callers, on="month_str", how="left")
-        .join(new_senders, on="month_str", how="left")
-        .join(new_receivers, on="month_str", how="left")
+        .join(new_callers, on="month_key", how="left")
+        .join(new_senders, on="month_key", how="left")
+        .join(new_receivers, on="month_key", how="left")
         .fill_null(0)
-        .sort("month_str")
+        .sort("month_key")
         .with_columns([
+            month_label(),
             pl.col("tx_count").cum_sum().alias("cum_tx_count"),
             pl.col("total_volume").cum_sum().alias("cum_volume"),
             pl.col("new_callers").cum_sum().alias("total_unique_callers"),
             pl.col("new_senders").cum_sum().alias("total_unique_senders"),
             pl.col("new_receivers").cum_sum().alias("total_unique_receivers")
         ])
+        .select([pl.col("month_str"), pl.exclude(["month_str", "month_key"])])
     )
+
+    # Clip the heatmap to the latest months so long histories don't bloat the page or the browser render
+    lf_heatmap = (
+        lf.filter(pl.col("month_key") > pl.col("month_key").max() - HEATMAP_MAX_MONTHS)
+        .group_by(["month_key", "day_of_month"])
+        .len()
+    )
+
+    try:
+        global_df, top_50_addresses, monthly_aggs, heatmap_df = pl.collect_all(
+            [lf_global, lf_leaderboard, lf_monthly, lf_heatmap]
+        )
+    except Exception as e:
+        logger.error(f"Error aggregating data for {token_symbol}: {e}")
+        return
+
+    # lf_global is a single row of every global stat, computed in one pass
+    stats = global_df.row(0, named=True)
+
+    if stats["total_txs"] == 0:
+        logger.warning(f"No transfer data found for {token_symbol}.")
+        return
+
     months = monthly_aggs["month_str"].to_list()
 
     # ---------------- PLOTS ----------------
@@ -157,188 +268,85 @@ def generate_eda_report(token_symbol: str):
     fig_sizes.update_layout(title="Transfer Size Dynamics Over Time", yaxis=dict(title="Average Size"), yaxis2=dict(title="Median Size", overlaying="y", side="right", type="log"), template=template_style, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
 
     # --- PIVOT FIX APPLIED HERE ---
-    heatmap_df = df.group_by(["month_str", "day_of_month"]).len()
     try:
         # Replaced 'on' with 'columns' for Polars < 1.0.0
-        matrix = heatmap_df.pivot(values="len", index="month_str", columns="day_of_month").fill_null(0).sort("month_str")
-        day_cols = sorted([col for col in matrix.columns if col != "month_str"], key=int)
-        z_data = [list(row) for row in matrix.select(day_cols).iter_rows()]
+        matrix = heatmap_df.pivot(values="len", index="month_key", columns="day_of_month").fill_null(0).sort("month_key")
+        day_cols = sorted([col for col in matrix.columns if col != "month_key"], key=int)
+        z_data = matrix.select(day_cols).to_numpy()
 
-        fig_heat = px.imshow(z_data, labels=dict(x="Day of Month", y="Month", color="Transactions"), x=day_cols, y=matrix["month_str"].to_list(), color_continuous_scale="Reds", aspect="auto")
+        fig_heat = px.imshow(z_data, labels=dict(x="Day of Month", y="Month", color="Transactions"), x=day_cols, y=matrix.select(month_label())["month_str"].to_list(), color_continuous_scale="Reds", aspect="auto")
         fig_heat.update_layout(title="Transaction Heatmap: Month vs Day of Month", template=template_style, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-        html_heat = pio.to_html(fig_heat, full_html=False, include_plotlyjs=False)
+        html_heat = plotly_div(fig_heat, "fig-heat")
     except Exception as e:
         logger.warning(f"Heatmap generation skipped: {e}")
         html_heat = f"<p style='text-align:center;'>Data distribution insufficient for Heatmap. ({e})</p>"
 
     # ---------------- HTML TEMPLATE ----------------
-    html_content = f"""
+    # Sections are yielded one at a time so each chart is serialized just before it is compressed
+    def html_sections():
+        yield f"""
     <!DOCTYPE html>
     <html>
     <head>
         <title>{token_symbol} Transfer Analytics</title>
-        <style>
-            body {{
-                margin: 0;
-                font-family: Inter, -apple-system, sans-serif;
-                background-color: #292929;
-                background-image: radial-gradient(#6c4d4d 1px, transparent 0);
-                background-size: 20px 20px;
-                color: #fff;
-                min-height: 100vh;
-            }}
-            .app {{
-                padding: 2rem;
-                max-width: 1400px;
-                margin: 0 auto;
-            }}
-            .title {{
-                text-align: center;
-                font-size: 2rem;
-                margin-bottom: 2rem;
-                color: #fff;
-            }}
-            .subtitle {{
-                text-align: center;
-                font-size: 1rem;
-                color: #aaa;
-                margin-bottom: 2rem;
-            }}
-            .grid {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-                gap: 2rem;
-                margin-bottom: 2rem;
-            }}
-            .grid-2 {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(500px, 1fr));
-                gap: 2rem;
-                margin-bottom: 2rem;
-            }}
-            .card {{
-                background-color: #3a3a3a;
-                border: 2px solid #444;
-                border-radius: 12px;
-                padding: 1.5rem;
-                display: flex;
-                flex-direction: column;
-                align-items: center;
-                justify-content: center;
-                transition: transform 0.2s ease, border-color 0.2s ease;
-            }}
-            .card:hover {{
-                border-color: #f77;
-                transform: scale(1.02);
-            }}
-            .stat-label {{
-                font-size: 1rem;
-                color: #aaa;
-                text-transform: uppercase;
-                margin-bottom: 0.5rem;
-                text-align: center;
-            }}
-            .stat-value {{
-                font-size: 2.2rem;
-                color: #f88;
-                font-weight: bold;
-                text-align: center;
-            }}
-            .chart-wrapper {{
-                background-color: #3a3a3a;
-                border: 2px solid #444;
-                border-radius: 12px;
-                padding: 1rem;
-                margin-bottom: 2rem;
-            }}
-            .table-wrapper {{
-                height: 500px;
-                overflow-y: auto;
-                background-color: #3a3a3a;
-                border: 2px solid #444;
-                border-radius: 12px;
-                padding: 1rem;
-                margin-bottom: 2rem;
-            }}
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                text-align: left;
-            }}
-            th {{
-                padding: 12px;
-                border-bottom: 2px solid #666;
-                color: #f88;
-                position: sticky;
-                top: 0;
-                background: #3a3a3a;
-                z-index: 10;
-            }}
-            td {{
-                padding: 12px;
-                border-bottom: 1px solid #444;
-                color: #ddd;
-            }}
-            ::-webkit-scrollbar {{ width: 8px; height: 8px; }}
-            ::-webkit-scrollbar-track {{ background: #292929; border-radius: 4px; }}
-            ::-webkit-scrollbar-thumb {{ background: #555; border-radius: 4px; }}
-            ::-webkit-scrollbar-thumb:hover {{ background: #f88; }}
-        </style>
+        <script src="{PLOTLY_CDN}"></script>
+        <style>{REPORT_CSS}</style>
     </head>
     <body>
         <div id="app" class="app">
             <h1 class="title">{token_symbol} Standard Transfers Analytics</h1>
-            <p class="subtitle">Period: {min_date} to {max_date}</p>
+            <p class="subtitle">Period: {stats['min_date']} to {stats['max_date']}</p>
 
             <div class="grid">
                 <div class="card">
                     <div class="stat-label">Total Transfers</div>
-                    <div class="stat-value">{total_txs:,}</div>
+                    <div class="stat-value">{stats['total_txs']:,}</div>
                 </div>
                 <div class="card">
                     <div class="stat-label">Total Unique Callers</div>
-                    <div class="stat-value">{u_caller:,}</div>
+                    <div class="stat-value">{stats['u_caller']:,}</div>
                 </div>
                 <div class="card">
                     <div class="stat-label">Total Unique Senders</div>
-                    <div class="stat-value">{u_from:,}</div>
+                    <div class="stat-value">{stats['u_from']:,}</div>
                 </div>
                 <div class="card">
                     <div class="stat-label">Total Unique Receivers</div>
-                    <div class="stat-value">{u_to:,}</div>
+                    <div class="stat-value">{stats['u_to']:,}</div>
                 </div>
             </div>
 
             <div class="grid">
                 <div class="card">
                     <div class="stat-label">Min Transfer</div>
-                    <div class="stat-value">{min_val:,.2f}</div>
+                    <div class="stat-value">{stats['min_val']:,.2f}</div>
                 </div>
                 <div class="card">
                     <div class="stat-label">Max Transfer</div>
-                    <div class="stat-value">{max_val:,.2f}</div>
+                    <div class="stat-value">{stats['max_val']:,.2f}</div>
                 </div>
                 <div class="card">
                     <div class="stat-label">Avg Transfer</div>
-                    <div class="stat-value">{mean_val:,.2f}</div>
+                    <div class="stat-value">{stats['mean_val']:,.2f}</div>
                 </div>
                 <div class="card">
                     <div class="stat-label">Median Transfer</div>
-                    <div class="stat-value">{median_val:,.2f}</div>
+                    <div class="stat-value">{stats['median_val']:,.2f}</div>
                 </div>
             </div>
 
-            <h2 class="title" style="font-size: 1.5rem; margin-top: 3rem;">Monthly Time Series Analysis</h2>
+            <h2 class="title" style="font-size: 1.5rem; margin-top: 3rem;">Monthly Time Series Analysis</h2>"""
+        yield f"""
             <div class="chart-wrapper">
-                {pio.to_html(fig_monthly, full_html=False, include_plotlyjs='cdn')}
-            </div>
-            
+                {plotly_div(fig_monthly, "fig-monthly")}
+            </div>"""
+        yield f"""
             <div class="chart-wrapper">
-                {pio.to_html(fig_addresses, full_html=False, include_plotlyjs=False)}
-            </div>
-
+                {plotly_div(fig_addresses, "fig-addresses")}
+            </div>"""
+        yield f"""
             <div class="chart-wrapper">
-                {pio.to_html(fig_sizes, full_html=False, include_plotlyjs=False)}
+                {plotly_div(fig_sizes, "fig-sizes")}
             </div>
 
             <h2 class="title" style="font-size: 1.5rem; margin-top: 3rem;">Activity Distribution</h2>
@@ -347,14 +355,14 @@ def generate_eda_report(token_symbol: str):
                 {html_heat}
             </div>
 
-            <h2 class="title" style="font-size: 1.5rem; margin-top: 3rem;">Growth & Cumulative Metrics</h2>
-            
+            <h2 class="title" style="font-size: 1.5rem; margin-top: 3rem;">Growth & Cumulative Metrics</h2>"""
+        yield f"""
             <div class="chart-wrapper">
-                {pio.to_html(fig_cum_activity, full_html=False, include_plotlyjs=False)}
-            </div>
-
+                {plotly_div(fig_cum_activity, "fig-cum-activity")}
+            </div>"""
+        yield f"""
             <div class="chart-wrapper">
-                {pio.to_html(fig_cum_users, full_html=False, include_plotlyjs=False)}
+                {plotly_div(fig_cum_users, "fig-cum-users")}
             </div>
             
             <h2 class="title" style="font-size: 1.5rem; margin-top: 3rem;">Top 100 Most Active Addresses</h2>
@@ -373,20 +381,31 @@ def generate_eda_report(token_symbol: str):
     """
     
     # ---------------- SAVE TO GOOGLE CLOUD STORAGE ----------------
-    client = storage.Client()
-    bucket = client.bucket(BUCKET_NAME)
+    # The HTML/figure JSON compresses well; GCS serves it with Content-Encoding: gzip.
+    # The page is fully built and gzipped in memory before the upload starts, so a failing section
+    # never finalizes a truncated report over the last good one
+    buf = io.BytesIO()
+    try:
+        with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6) as gz:
+            for section in html_sections():
+                gz.write(section.encode("utf-8"))
+    except Exception as e:
+        logger.error(f"Error rendering report for {token_symbol}: {e}")
+        return
 
-    blob_name = f"{REPORTS_FOLDER}/{token_symbol}_transfers_eda.html"
-    bucket.blob(blob_name).upload_from_string(
-        html_content,
-        content_type="text/html"
-    )
+    blob = bucket.blob(blob_name)
+    blob.content_encoding = "gzip"
+    blob.cache_control = "public, max-age=300"
+    size = buf.getbuffer().nbytes
+    buf.seek(0)
+    blob.upload_from_file(buf, content_type="text/html", size=size)
 
     logger.info(f"Report securely saved to Google Cloud Storage: gs://{BUCKET_NAME}/{blob_name}")
 
 def main():
-    for token in TOKENS:
-        generate_eda_report(token.symbol)
+    # --force regenerates every report even if its sources haven't changed
+    force = "--force" in sys.argv[1:]
+    run_per_token(partial(generate_eda_report, force=force), [token.symbol for token in TOKENS])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,14 @@
-import os
+import io
 import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import polars as pl
 import plotly.graph_objects as go
 import plotly.express as px
 import plotly.io as pio
 from google.cloud import storage
-from config import TOKENS, BUCKET_NAME, PROCESSED_FOLDER, REPORTS_FOLDER
+from config import TOKENS, BUCKET_NAME, PROCESSED_FOLDER, REPORTS_FOLDER, UPLOAD_WORKERS
+from utils import get_gcs_client, upload_buffer, run_per_token, PLOTLY_CDN
 
 # ---------------- LOGGING ----------------
 logging.basicConfig(
@@ -21,23 +23,63 @@ DUST_THRESHOLD = 1/100_000_000       # (< 0.000_000_1%) tokens = "Out/Dust"
 RETAIL_THRESHOLD = 1/100_000    # (< 0.000_1%) tokens = "Retail"
 WHALE_THRESHOLD = 1/1_000    # (owns >0.1%) tokens = "Whale"
 
-def generate_user_stats(df: pl.DataFrame) -> pl.DataFrame:
+# One top-holder card; each {} is filled column-wise by pl.format in generate_user_cards_html
+USER_CARD_TEMPLATE = """
+        <div class="user-card frosted">
+            <div class="uc-header" title="{}">{}</div>
+            <div class="uc-body">
+                <div class="uc-quad">
+                    <strong>Inbound</strong><br/>
+                    Tx Count: {}<br/>
+                    Vol: {}<br/>
+                    First: {}<br/>
+                    Last: {}
+                </div>
+                <div class="uc-quad">
+                    <strong>Outbound</strong><br/>
+                    Tx Count: {}<br/>
+                    Vol: {}<br/>
+                    First: {}<br/>
+                    Last: {}
+                </div>
+            </div>
+            <div class="uc-footer">
+                <div><strong>Total Tx:</strong> {}</div>
+                <div><strong>Total Vol:</strong> {}</div>
+                <div><strong>Balance:</strong> {}</div>
+                <div><strong>Net Flow:</strong> {}</div>
+            </div>
+        </div>
+        """
+
+def save_parquet(bucket, blob_path: str, df: pl.DataFrame):
+    """Writes a frame as zstd Parquet in memory and uploads it (no /tmp round-trip)."""
+    buf = io.BytesIO()
+    df.write_parquet(buf, compression="zstd")
+    upload_buffer(bucket, blob_path, buf)
+
+def generate_user_stats(lf: pl.LazyFrame) -> pl.LazyFrame:
     """Step 1: Aggregate Lifetime User Stats"""
-    in_stats = df.group_by("to").agg([
-        pl.len().alias("in_tx_count"),
-        pl.sum("value").alias("in_vol"),
-        pl.min("date_utc").alias("first_in_date"),
-        pl.max("date_utc").alias("last_in_date")
-    ]).rename({"to": "address"})
-
-    out_stats = df.group_by("from").agg([
-        pl.len().alias("out_tx_count"),
-        pl.sum("value").alias("out_vol"),
-        pl.min("date_utc").alias("first_out_date"),
-        pl.max("date_utc").alias("last_out_date")
-    ]).rename({"from": "address"})
-
-    user_stats = in_stats.join(out_stats, on="address", how="outer").fill_null(0)
+    # One row per side of each transfer, so both directions aggregate in a single group_by (no join)
+    sides = pl.concat([
+        lf.select([pl.col("to").alias("address"), pl.col("value"), pl.col("date_utc"), pl.lit(True).alias("is_in")]),
+        lf.select([pl.col("from").alias("address"), pl.col("value"), pl.col("date_utc"), pl.lit(False).alias("is_in")]),
+    ])
+
+    is_in = pl.col("is_in")
+    is_out = ~pl.col("is_in")
+
+    user_stats = sides.group_by("address").agg([
+        is_in.sum().alias("in_tx_count"),
+        pl.col("value").filter(is_in).sum().alias("in_vol"),
+        pl.col("date_utc").filter(is_in).min().alias("first_in_date"),
+        pl.col("date_utc").filter(is_in).max().alias("last_in_date"),
+
+        is_out.sum().alias("out_tx_count"),
+        pl.col("value").filter(is_out).sum().alias("out_vol"),
+        pl.col("date_utc").filter(is_out).min().alias("first_out_date"),
+        pl.col("date_utc").filter(is_out).max().alias("last_out_date")
+    ])
     
     user_stats = user_stats.with_columns([
         (pl.col("in_tx_count") + pl.col("out_tx_count")).alias("total_tx_count"),
@@ -50,25 +92,18 @@ def generate_user_stats(df: pl.DataFrame) -> pl.DataFrame:
 
     return user_stats
 
-def generate_daily_ledger(df: pl.DataFrame) -> pl.DataFrame:
+def generate_daily_ledger(lf: pl.LazyFrame) -> pl.LazyFrame:
     """Step 2: The 'Ledger' Transformation"""
-    debits = df.select([
-        pl.col("from").alias("address"),
-        (pl.col("value") * -1).alias("delta"),
-        pl.col("date_utc")
-    ])
-
-    credits = df.select([
-        pl.col("to").alias("address"),
-        pl.col("value").alias("delta"),
-        pl.col("date_utc")
-    ])
-
-    ledger = pl.concat([debits, credits]).sort(["address", "date_utc"])
-
-    daily_ledger = ledger.group_by(["address", "date_utc"]).agg(
+    # Aggregate each side straight off the transfers: the sender is debited, the receiver credited.
+    # Only the per-(address, date) partials are concatenated, never a 2N-row copy of the transfers
+    outs = lf.group_by(["from", "date_utc"]).agg((-pl.sum("value")).alias("delta")).rename({"from": "address"})
+    ins = lf.group_by(["to", "date_utc"]).agg(pl.sum("value").alias("delta")).rename({"to": "address"})
+
+    # Hash group_by ignores input order. The windows below only need each address's rows in date order,
+    # and over() keeps the frame's row order inside every group, so sorting on the date alone is enough
+    daily_ledger = pl.concat([outs, ins]).group_by(["address", "date_utc"]).agg(
         pl.sum("delta").alias("daily_change")
-    ).sort(["address", "date_utc"])
+    ).sort("date_utc")
 
     daily_ledger = daily_ledger.with_columns(
         pl.col("daily_change").cum_sum().over("address").alias("balance")
@@ -76,31 +111,42 @@ def generate_daily_ledger(df: pl.DataFrame) -> pl.DataFrame:
     logger.info("generate_daily_ledger schema: %s", daily_ledger.schema)
     return daily_ledger
 
-def classify_behavior(ledger_df: pl.DataFrame, supply: int) -> pl.DataFrame:
+def classify_behavior(ledger_lf: pl.LazyFrame, supply: int) -> pl.LazyFrame:
     """Step 3: User/Date Level Classification"""
-    df = ledger_df.with_columns([
-        pl.when(pl.col("balance") < DUST_THRESHOLD * supply).then(pl.lit("Dust"))
-          .when(pl.col("balance") < RETAIL_THRESHOLD * supply).then(pl.lit("Retail"))
-          .when(pl.col("balance") >= WHALE_THRESHOLD * supply).then(pl.lit("Whale"))
+    # Absolute balance thresholds for this token, computed once
+    dust = DUST_THRESHOLD * supply
+    retail = RETAIL_THRESHOLD * supply
+    whale = WHALE_THRESHOLD * supply
+
+    # Previous day's balance per address (rows are date-ordered), used inline rather than stored as a column
+    prev_balance = pl.col("balance").shift(1).over("address").fill_null(0)
+
+    lf = ledger_lf.with_columns([
+        pl.when(pl.col("balance") < dust).then(pl.lit("Dust"))
+          .when(pl.col("balance") < retail).then(pl.lit("Retail"))
+          .when(pl.col("balance") >= whale).then(pl.lit("Whale"))
           .otherwise(pl.lit("Holder"))
           .alias("wealth_class"),
 
-        pl.when(pl.col("balance") < DUST_THRESHOLD * supply).then(pl.lit("Out"))
+        pl.when(pl.col("balance") < dust).then(pl.lit("Out"))
           .otherwise(pl.lit("In"))
           .alias("status_simple"),
-          
-        pl.col("balance").shift(1).over("address").fill_null(0).alias("prev_balance")
-    ]).with_columns([
-        pl.when(pl.col("prev_balance") == 0).then(pl.lit("Just Joined"))
-          .when(pl.col("balance") > pl.col("prev_balance")).then(pl.lit("Accumulating"))
-          .when(pl.col("balance") < DUST_THRESHOLD * supply).then(pl.lit("Completely Sold"))
-          .when(pl.col("balance") < pl.col("prev_balance")).then(pl.lit("Distributing"))
+
+        pl.when(prev_balance == 0).then(pl.lit("Just Joined"))
+          .when(pl.col("balance") > prev_balance).then(pl.lit("Accumulating"))
+          .when(pl.col("balance") < dust).then(pl.lit("Completely Sold"))
+          .when(pl.col("balance") < prev_balance).then(pl.lit("Distributing"))
           .otherwise(pl.lit("Holding"))
           .alias("action_class")
-    ]).drop("prev_balance")
+    ])
+
+    logger.info("classify_behavior schema: %s", lf.schema)
+    return lf
 
-    logger.info("classify_behavior schema: %s", df.schema)
-    return df
+def format_number(expr: pl.Expr, decimals: int = 0) -> pl.Expr:
+    """f"{x:,}" (or f"{x:,.Nf}" when decimals) per value; only ever applied to the 50 top-holder rows."""
+    spec = f"{{:,.{decimals}f}}" if decimals else "{:,}"
+    return expr.map_elements(spec.format, return_dtype=pl.Utf8).fill_null("N/A")
 
 def generate_user_cards_html(user_stats_df: pl.DataFrame) -> str:
     """Helper to generate the top 50 user quadrant cards"""
@@ -108,104 +154,98 @@ def generate_user_cards_html(user_stats_df: pl.DataFrame) -> str:
         return "<p>No top users available.</p>"
 
     top_50 = user_stats_df.sort("current_balance_approx", descending=True).head(50)
-    
-    cards_html = []
-    for row in top_50.iter_rows(named=True):
-        addr = row.get("address", "Unknown")
-        
-        in_tx = f"{row.get('in_tx_count', 0):,}"
-        in_vol = f"{row.get('in_vol', 0):,.2f}"
-        f_in = str(row.get('first_in_date', 'N/A'))
-        l_in = str(row.get('last_in_date', 'N/A'))
-        
-        out_tx = f"{row.get('out_tx_count', 0):,}"
-        out_vol = f"{row.get('out_vol', 0):,.2f}"
-        f_out = str(row.get('first_out_date', 'N/A'))
-        l_out = str(row.get('last_out_date', 'N/A'))
-        
-        tot_tx = f"{row.get('total_tx_count', 0):,}"
-        tot_vol = f"{row.get('total_volume', 0):,.2f}"
-        bal = f"{row.get('current_balance_approx', 0):,.2f}"
-        net = f"{row.get('net_flow', 0):,.2f}"
 
-        card = f"""
-        <div class="user-card frosted">
-            <div class="uc-header" title="{addr}">{addr}</div>
-            <div class="uc-body">
-                <div class="uc-quad">
-                    <strong>Inbound</strong><br/>
-                    Tx Count: {in_tx}<br/>
-                    Vol: {in_vol}<br/>
-                    First: {f_in}<br/>
-                    Last: {l_in}
-                </div>
-                <div class="uc-quad">
-                    <strong>Outbound</strong><br/>
-                    Tx Count: {out_tx}<br/>
-                    Vol: {out_vol}<br/>
-                    First: {f_out}<br/>
-                    Last: {l_out}
-                </div>
-            </div>
-            <div class="uc-footer">
-                <div><strong>Total Tx:</strong> {tot_tx}</div>
-                <div><strong>Total Vol:</strong> {tot_vol}</div>
-                <div><strong>Balance:</strong> {bal}</div>
-                <div><strong>Net Flow:</strong> {net}</div>
-            </div>
-        </div>
-        """
-        cards_html.append(card)
-
-    return f'<div class="user-cards-grid">{"".join(cards_html)}</div>'
+    def fmt_date(col: str) -> pl.Expr:
+        return pl.col(col).cast(pl.Utf8).fill_null("N/A")
+
+    # Every card is rendered by one pl.format over the 50 rows
+    cards = top_50.select(
+        pl.format(
+            USER_CARD_TEMPLATE,
+            pl.col("address").cast(pl.Utf8).fill_null("Unknown"),
+            pl.col("address").cast(pl.Utf8).fill_null("Unknown"),
+            format_number(pl.col("in_tx_count")),
+            format_number(pl.col("in_vol"), 2),
+            fmt_date("first_in_date"),
+            fmt_date("last_in_date"),
+            format_number(pl.col("out_tx_count")),
+            format_number(pl.col("out_vol"), 2),
+            fmt_date("first_out_date"),
+            fmt_date("last_out_date"),
+            format_number(pl.col("total_tx_count")),
+            format_number(pl.col("total_volume"), 2),
+            format_number(pl.col("current_balance_approx"), 2),
+            format_number(pl.col("net_flow"), 2),
+        ).alias("card_html")
+    )["card_html"]
+
+    return f'<div class="user-cards-grid">{"".join(cards.to_list())}</div>'
 
 def generate_users_dashboard(symbol: str, user_stats_df: pl.DataFrame, ledger_df: pl.DataFrame, bucket: storage.Bucket):
     """Step 4: Generate and Upload HTML Dashboard"""
     logger.info(f"Generating Users Dashboard for {symbol}...")
 
-    latest_state = ledger_df.sort(["address", "date_utc"]).group_by("address").last()
-    
-    total_users = len(latest_state)
-    whales = len(latest_state.filter(pl.col("wealth_class") == "Whale"))
-    retail = len(latest_state.filter(pl.col("wealth_class") == "Retail"))
-    out_dust = len(latest_state.filter(pl.col("wealth_class") == "Dust"))
+    # KPI and chart aggregates are lazy over the same ledger and collected in one parallel pass
+    ledger_lf = ledger_df.lazy()
+
+    # The ledger arrives date-sorted (generate_daily_ledger) and last() keeps input order within each group,
+    # so each address's latest class needs no sort at all; only the column the KPIs read is aggregated
+    latest_lf = ledger_lf.group_by("address").agg(pl.col("wealth_class").last())
+    kpi_lf = latest_lf.select([
+        pl.len().alias("total_users"),
+        (pl.col("wealth_class") == "Whale").sum().alias("whales"),
+        (pl.col("wealth_class") == "Retail").sum().alias("retail"),
+        (pl.col("wealth_class") == "Dust").sum().alias("out_dust"),
+    ])
+
+    top_30 = ledger_lf.group_by("address").agg(pl.max("balance").alias("max_b")).top_k(30, by="max_b").select("address")
+    # Weekly closing balance per address keeps the line chart's JSON small on long histories
+    g1_lf = (
+        ledger_lf.join(top_30, on="address", how="semi")
+        .sort("date_utc")
+        .group_by_dynamic("date_utc", every="1w", by="address")
+        .agg(pl.col("balance").last())
+        .sort(["address", "date_utc"])
+    )
+    g2_lf = ledger_lf.group_by(["date_utc", "wealth_class"]).len().sort("date_utc")
+    g4_lf = ledger_lf.group_by(["date_utc", "status_simple"]).len().with_columns(
+        pl.when(pl.col("status_simple") == "Out").then(pl.col("len") * -1).otherwise(pl.col("len")).alias("plot_val")
+    ).sort("date_utc")
+    g5_lf = ledger_lf.group_by(["date_utc", "action_class"]).len().sort("date_utc")
+
+    kpi_df, g1_df, g2_df, g4_df, g5_df = pl.collect_all([kpi_lf, g1_lf, g2_lf, g4_lf, g5_lf])
+
+    # All four KPI cards come from one single-row aggregate
+    total_users, whales, retail, out_dust = kpi_df.row(0)
 
     template_style = "plotly_dark"
     graphs_html = []
 
     try:
         # 1. Top 30 Addresses by Max Balance (Line)
-        top_30_addrs = ledger_df.group_by("address").agg(pl.max("balance").alias("max_b")).sort("max_b", descending=True).head(30)["address"].to_list()
-        g1_df = ledger_df.filter(pl.col("address").is_in(top_30_addrs)).sort(["address", "date_utc"])
         fig1 = px.line(g1_df, x="date_utc", y="balance", color="address", title="Top 30 Addresses by Max Balance")
         fig1.update_layout(template=template_style, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-        graphs_html.append(pio.to_html(fig1, full_html=False, include_plotlyjs='cdn'))
+        graphs_html.append(pio.to_html(fig1, full_html=False, include_plotlyjs=False, validate=False))
 
         # 2. Wealth Class Counts (Side-by-Side Bar)
-        g2_df = ledger_df.group_by(["date_utc", "wealth_class"]).len().sort("date_utc")
         fig2 = px.bar(g2_df, x="date_utc", y="len", color="wealth_class", barmode="stack", title="Wealth Class Counts (Grouped)")
         fig2.update_layout(template=template_style, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-        graphs_html.append(pio.to_html(fig2, full_html=False, include_plotlyjs=False))
+        graphs_html.append(pio.to_html(fig2, full_html=False, include_plotlyjs=False, validate=False))
 
         # 3. Wealth Class Counts (100% Stacked Bar)
         fig3 = px.bar(g2_df, x="date_utc", y="len", color="wealth_class", title="Wealth Class Composition (%)")
         fig3.update_layout(barmode='stack', barnorm='percent', template=template_style, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-        graphs_html.append(pio.to_html(fig3, full_html=False, include_plotlyjs=False))
+        graphs_html.append(pio.to_html(fig3, full_html=False, include_plotlyjs=False, validate=False))
 
         # 4. Simple Status In/Out (Positive/Negative Bar)
-        g4_df = ledger_df.group_by(["date_utc", "status_simple"]).len()
-        g4_df = g4_df.with_columns(
-            pl.when(pl.col("status_simple") == "Out").then(pl.col("len") * -1).otherwise(pl.col("len")).alias("plot_val")
-        ).sort("date_utc")
         fig4 = px.bar(g4_df, x="date_utc", y="plot_val", color="status_simple", title="Network Status (In vs Out)")
         fig4.update_layout(template=template_style, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-        graphs_html.append(pio.to_html(fig4, full_html=False, include_plotlyjs=False))
+        graphs_html.append(pio.to_html(fig4, full_html=False, include_plotlyjs=False, validate=False))
 
         # 5. Action Class (100% Stacked Bar)
-        g5_df = ledger_df.group_by(["date_utc", "action_class"]).len().sort("date_utc")
         fig5 = px.bar(g5_df, x="date_utc", y="len", color="action_class", title="Action Class Composition (%)")
         fig5.update_layout(barmode='stack', barnorm='percent', template=template_style, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
-        graphs_html.append(pio.to_html(fig5, full_html=False, include_plotlyjs=False))
+        graphs_html.append(pio.to_html(fig5, full_html=False, include_plotlyjs=False, validate=False))
 
     except Exception as e:
         logger.warning(f"Error generating Plotly graphs: {e}")
@@ -217,6 +257,7 @@ def generate_users_dashboard(symbol: str, user_stats_df: pl.DataFrame, ledger_df
     <html>
     <head>
         <title>{symbol} User & Behavioral Analytics</title>
+        <script src="{PLOTLY_CDN}"></script>
         <style>
             body {{
                 margin: 0;
@@ -348,63 +389,78 @@ def generate_users_dashboard(symbol: str, user_stats_df: pl.DataFrame, ledger_df
     logger.info(f"User Dashboard securely saved to: gs://{BUCKET_NAME}/{blob_name}")
 
 
-def process_users(token_def):
+def process_users(token_def, bucket: storage.Bucket):
     symbol = token_def.symbol
     logger.info(f"--- Building User Profiles for {symbol} ---")
 
     try:
         path = f"gs://{BUCKET_NAME}/processed_normal_transfers/token={symbol}/**/*.parquet"
-        lf = pl.scan_parquet(path, hive_partitioning=False)
-        
-        lf = lf.with_columns(
-            pl.from_epoch(pl.col("timeStamp"), time_unit="s").dt.date().alias("date_utc")
-        )
+        # Only the columns the user pipeline reads; the select is pushed down into the Parquet reader
+        # date_utc is written by the processing layer, so no epoch parsing happens here
+        lf = pl.scan_parquet(path, hive_partitioning=False).select(["from", "to", "value", "date_utc"])
         
-        df = lf.collect()
-        if df.is_empty():
-            logger.warning("No data found.")
-            return
+        # Addresses become Categorical codes so the aggregations below hash u32s, not strings.
+        # from/to (and the stats/ledger built from them) must share one dictionary, hence the global string cache.
+        # Outputs are cast back to strings: the parquet schema and plotly both expect plain addresses
+        pl.enable_string_cache()
+        lf = lf.with_columns([
+            pl.col("from").cast(pl.Categorical),
+            pl.col("to").cast(pl.Categorical),
+        ])
+
+        # collect_all plans each LazyFrame separately, so read the projected transfers once
+        lf = lf.collect().lazy()
 
     except Exception as e:
         logger.error(f"Failed to load transfers: {e}")
         return
 
+    # Stats and ledger stay lazy over the in-memory transfers and are collected together in parallel
     try:
-        user_stats_df = generate_user_stats(df)
-        ledger_df = generate_daily_ledger(df)
-        ledger_df = classify_behavior(ledger_df, token_def.supply)
+        to_str = pl.col("address").cast(pl.Utf8)
+        user_stats_lf = generate_user_stats(lf).with_columns(to_str)
+        ledger_lf = classify_behavior(generate_daily_ledger(lf), token_def.supply).with_columns(to_str)
+
+        user_stats_df, ledger_df = pl.collect_all([user_stats_lf, ledger_lf])
 
     except Exception as e:
         logger.error(f"Failed processing logic: {e}")
         return
 
-    client = storage.Client()
-    bucket = client.bucket(BUCKET_NAME)
-    
+    if ledger_df.is_empty():
+        logger.warning("No data found.")
+        return
+
     # --- SAVE TO GOOGLE CLOUD STORAGE ---
-    local_stats = f"/tmp/{symbol}_users.parquet"
-    user_stats_df.write_parquet(local_stats)
-    bucket.blob(f"user_analytics/token={symbol}/lifetime_stats.parquet").upload_from_filename(local_stats)
-    os.remove(local_stats)
+    save_parquet(bucket, f"user_analytics/token={symbol}/lifetime_stats.parquet", user_stats_df)
     
-    ledger_df = ledger_df.with_columns(pl.col("date_utc").dt.strftime("%Y-%m").alias("month_str"))
     logger.info(f"Saving Ledger ({len(ledger_df)} rows)...")
     
-    for part_df in ledger_df.partition_by("month_str"):
-        m = part_df["month_str"][0]
-        local_ledger = f"/tmp/{symbol}_ledger_{m}.parquet"
-        part_df.write_parquet(local_ledger)
-        bucket.blob(f"ledger/token={symbol}/month={m}/data.parquet").upload_from_filename(local_ledger)
-        os.remove(local_ledger)
+    # The ledger is date-sorted, so each month is a contiguous run of rows: write zero-copy slices
+    # instead of materialising a partition_by copy of every month
+    # Month keys are Dates from dt.truncate, formatted only once per month for the path
+    month_sizes = ledger_df.group_by(pl.col("date_utc").dt.truncate("1mo").alias("month"), maintain_order=True).len()
+    parts = []
+    offset = 0
+    for m, n_rows in month_sizes.iter_rows():
+        parts.append((f"ledger/token={symbol}/month={m.strftime('%Y-%m')}/data.parquet", ledger_df.slice(offset, n_rows)))
+        offset += n_rows
+
+    # Uploads are network-bound, so months go up concurrently
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        list(pool.map(lambda item: save_parquet(bucket, *item), parts))
 
     # --- GENERATE DASHBOARD ---
     generate_users_dashboard(symbol, user_stats_df, ledger_df, bucket)
 
     logger.info("User Profiling Complete.")
 
+def process_token(token_def):
+    """Pool entry point: buckets don't pickle, so each worker builds its own from its per-process client."""
+    process_users(token_def, get_gcs_client().bucket(BUCKET_NAME))
+
 def main():
-    for token in TOKENS:
-        process_users(token)
+    run_per_token(process_token, TOKENS)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
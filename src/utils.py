@@ -1,16 +1,38 @@
+import io
+import os
 import json
 import logging
+import multiprocessing
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import re
+import functools
 import polars as pl
 from google.cloud import storage
-from config import SCAN_API_KEY, BASE_URL, DROPCOLS_INGEST, MAX_RESULT_SIZE
+from plotly.offline import get_plotlyjs_version
+from config import (
+    SCAN_API_KEY, BASE_URL, KEEP_COLS_ORDERED, LOWERCASE_COLS, MAX_RESULT_SIZE, API_MIN_INTERVAL, UPLOAD_CHUNK_SIZE, UPLOAD_WORKERS,
+    TRANSFER_METHOD_ID, TRANSFER_FROM_METHOD_ID, APPROVE_METHOD_ID
+)
 
 logger = logging.getLogger(__name__)
 STATE_FILE_PATH = "state/global_state.json"
 
+# HTML pages load plotly.js once in <head>, pinned to the bundle this plotly version was built against
+PLOTLY_CDN = f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+# API fields read at ingest (all returned as strings)
+INGEST_SCHEMA = {
+    col: pl.Utf8 for col in (
+        "blockNumber", "timeStamp", "hash", "from", "to", "value",
+        "input", "methodId", "functionName", "isError"
+    )
+}
+
 # --- DATA CLEANERS ---
 def trim_ingestion(buffer: list):
     """
@@ -19,10 +41,12 @@ def trim_ingestion(buffer: list):
     2.1 Cleans function names (removes args).
     2.2 Filters out 'approve' functions based on name.
     4. Adds 'month' column for monthly partitioning.
+    5. Lowercases hex & name columns.
     """
     if not buffer: return None
 
-    df = pl.DataFrame(buffer)
+    # Explicit schema: Polars only materializes these keys and skips type inference
+    df = pl.from_dicts(buffer, schema=INGEST_SCHEMA, infer_schema_length=0)
 
     if df.is_empty(): return None
 
@@ -64,14 +88,48 @@ def trim_ingestion(buffer: list):
         pl.col("dt").dt.strftime("%Y-%m").alias("month")
     ).drop("dt")
 
-    # 4. Drop Columns
-    df = df.drop(DROPCOLS_INGEST)
-    #existing = [c for c in KEEP_COLS if c in df.columns]
+    # 4. Keep Columns (fixed order)
+    df = df.select(KEEP_COLS_ORDERED)
+
+    # 5. Normalize hex & name columns once, so downstream layers never re-lowercase
+    df = df.with_columns([pl.col(c).str.to_lowercase() for c in LOWERCASE_COLS])
     return df
     
+class HashDeduper:
+    """
+    Filters txs by hash against everything ingested this run plus the floor block persisted from earlier runs.
+    Hashes are only committed once their data has been flushed, so a failed write never hides rows from a retry.
+    """
+    def __init__(self, floor_hashes=(), floor_block: int = None):
+        self.committed = dict.fromkeys(floor_hashes, floor_block)  # hash -> block number
+        self.pending = {}
+
+    def filter(self, batch: list) -> list:
+        fresh = [t for t in batch if t["hash"] not in self.committed and t["hash"] not in self.pending]
+        self.pending.update((t["hash"], int(t["blockNumber"])) for t in fresh)
+        return fresh
+
+    def commit(self):
+        self.committed.update(self.pending)
+        self.pending = {}
+
+    def rollback(self):
+        """Forgets hashes whose data was never flushed."""
+        self.pending = {}
+
+    def hashes_at(self, block: int) -> list:
+        """Committed hashes of one block."""
+        return [h for h, b in self.committed.items() if b == block]
+
 # --- GCS HELPERS ---
-def get_gcs_client():
-    return storage.Client()
+_GCS_CLIENT = None
+
+def get_gcs_client() -> storage.Client:
+    """One client per process: credentials and the HTTP connection pool are reused across uploads."""
+    global _GCS_CLIENT
+    if _GCS_CLIENT is None:
+        _GCS_CLIENT = storage.Client()
+    return _GCS_CLIENT
 
 def load_state(bucket):
     """Loads the ingestion state (cursor) from GCS."""
@@ -85,19 +143,34 @@ def save_state(bucket, state):
     blob = bucket.blob("state/global_state.json")
     blob.upload_from_string(json.dumps(state, indent=2), content_type="application/json")
 
-def save_buffer(df: pl.DataFrame, symbol: str, bucket_name: str, prefix: str):
+def upload_buffer(bucket, blob_path: str, buf, content_type: str = "application/octet-stream"):
+    """
+    Uploads an in-memory bytes buffer to GCS.
+    Small buffers go up in a single request; chunked resumable upload only above UPLOAD_CHUNK_SIZE.
+    """
+    size = buf.getbuffer().nbytes
+    buf.seek(0)
+
+    blob = bucket.blob(blob_path)
+    if size > UPLOAD_CHUNK_SIZE:
+        blob.chunk_size = UPLOAD_CHUNK_SIZE
+    blob.upload_from_file(buf, content_type=content_type, size=size)
+    return blob
+
+def save_buffer(df: pl.DataFrame, symbol: str, bucket_name: str, prefix: str, compression: str = "lz4"):
     """
     Docstring for save_buffer
     
     > Partitions by Month.
     > Saves to GCS.
+    > Raw files are read once by process.py, so a fast codec (lz4) beats a dense one (zstd).
     """
     # 6. Save (One file per Month found in buffer)
     client = get_gcs_client()
     bucket = client.bucket(bucket_name)
-    run_ts = int(time.time())
+    run_ts = time.time_ns()  # Unique per flush, even within the same second
 
-    for part_df in df.partition_by("month"):
+    def save_month(part_df: pl.DataFrame):
         month_str = part_df["month"][0]
 
         # 🔍 Log schema once per partition
@@ -106,21 +179,61 @@ def save_buffer(df: pl.DataFrame, symbol: str, bucket_name: str, prefix: str):
 
         # Naming: {prefix}_{timestamp}.parquet
         filename = f"{prefix}_{run_ts}.parquet"
-        local_path = f"/tmp/{symbol}_{filename}"
 
         # Partition Structure: token=XY/month=YYYY-MM/
         blob_path = f"raw_normal_data/token={symbol}/month={month_str}/{filename}"
 
-        part_df.write_parquet(local_path)
-
-        blob = bucket.blob(blob_path)
-        blob.upload_from_filename(local_path)
+        # Serialized in memory; upload_buffer passes size= so small files go up in one request
+        buf = io.BytesIO()
+        part_df.write_parquet(buf, compression=compression)
+        upload_buffer(bucket, blob_path, buf)
 
         logger.info(f"Saved {len(part_df)} rows to {blob_path}")
 
-        os.remove(local_path)
+    # Uploads are network-bound, so months go up concurrently; list() re-raises any upload error
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        list(pool.map(save_month, df.partition_by("month")))
+
+# --- PROCESS HELPERS ---
+def run_per_token(fn, items) -> list:
+    """Runs fn over items (one per token) in a process pool and returns the results in order."""
+    items = list(items)
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(len(items), cpus // 2))
+
+    # Split the cores between workers so the children's Polars pools don't oversubscribe
+    os.environ.setdefault("POLARS_MAX_THREADS", str(max(1, cpus // workers)))
+
+    # spawn: forking after Polars has started its thread pool can deadlock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+        return list(ex.map(fn, items))
 
 # --- API HELPERS ---
+class RateLimiter:
+    """Thread-safe pacing: hands out request slots at least `min_interval` seconds apart across all threads."""
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+API_RATE_LIMITER = RateLimiter(API_MIN_INTERVAL)
+
+# One pooled session for every API call: keeps TCP/TLS connections alive across batches and tokens
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
 def get_chain_tip():
     """Fetches the latest block number."""
     params = {
@@ -129,7 +242,7 @@ def get_chain_tip():
         "apikey": SCAN_API_KEY
     }
     try:
-        response = requests.get(BASE_URL, params=params, timeout=10)
+        response = _SESSION.get(BASE_URL, params=params, timeout=10)
         data = response.json()
         if "result" in data:
             return int(data["result"], 16)
@@ -155,8 +268,8 @@ def get_contract_creation_block(address):
         "contractaddresses": address, "apikey": SCAN_API_KEY
     }
     try:
-        time.sleep(0.201) # Rate limit wait
-        resp = requests.get(BASE_URL, params=params_create, timeout=10).json()
+        API_RATE_LIMITER.wait() # Rate limit wait
+        resp = _SESSION.get(BASE_URL, params=params_create, timeout=10).json()
         
         if resp["status"] == "0" or not resp["result"]:
             logger.warning(f"Could not find creation tx for {address}. (Might be too old or proxy?)")
@@ -171,8 +284,8 @@ def get_contract_creation_block(address):
             "txhash": tx_hash, "apikey": SCAN_API_KEY
         }
 
-        time.sleep(0.201) # Rate limit wait
-        resp_tx = requests.get(BASE_URL, params=params_tx, timeout=10).json()
+        API_RATE_LIMITER.wait() # Rate limit wait
+        resp_tx = _SESSION.get(BASE_URL, params=params_tx, timeout=10).json()
         
         if not resp_tx.get("result"):
              return 0
@@ -210,8 +323,8 @@ def fetch_normal_batch(address, start_block, end_block, sort="asc"):
     
     for attempt in range(2):
         try:
-            time.sleep(0.201) # Rate limit wait
-            response = requests.get(BASE_URL, params=params, timeout=10)
+            API_RATE_LIMITER.wait() # Rate limit wait
+            response = _SESSION.get(BASE_URL, params=params, timeout=10)
             data = response.json()
             
             if data["status"] == "1":
@@ -227,23 +340,27 @@ def fetch_normal_batch(address, start_block, end_block, sort="asc"):
     return []
 
 # --- DECODER HELPERS ---
+_SIG_PARAMS_RE = re.compile(r'\((.*?)\)')
+
+# Only a few hundred distinct ABIs exist, so each one is parsed once per process
+@functools.lru_cache(maxsize=4096)
 def parse_signature(signature):
     """
     Parses a signature like 'transferfrom(address from, address to, uint256 value) returns (bool)'
-    Returns a list of tuples: [('address', 'from'), ('address', 'to'), ('uint256', 'value')]
+    Returns a tuple of tuples: (('address', 'from'), ('address', 'to'), ('uint256', 'value'))
     """
     # Replace pd.isna with standard None and type checking
     if signature is None or not isinstance(signature, str) or signature.strip() == '':
-        return []
+        return ()
     
     # Extract the part inside the first set of parentheses
-    match = re.search(r'\((.*?)\)', signature)
+    match = _SIG_PARAMS_RE.search(signature)
     if not match:
-        return []
+        return ()
     
     params_str = match.group(1)
     if not params_str.strip():
-        return []
+        return ()
     
     # Split by comma to get individual parameters
     params = params_str.split(',')
@@ -260,22 +377,56 @@ def parse_signature(signature):
             param_name = f"param_{len(parsed_params)}"
         parsed_params.append((param_type, param_name))
         
-    return parsed_params
+    # Cached results are shared between callers, so hand out an immutable tuple
+    return tuple(parsed_params)
+
+# Fast paths for well-known selectors: fixed slices of "0x" + 8-char methodId + 64-char words
+def _decode_transfer(input_hex):
+    return {"to": "0x" + input_hex[34:74], "value": int(input_hex[74:138], 16)}
+
+def _decode_transfer_from(input_hex):
+    return {"from": "0x" + input_hex[34:74], "to": "0x" + input_hex[98:138], "value": int(input_hex[138:202], 16)}
+
+def _decode_approve(input_hex):
+    return {"spender": "0x" + input_hex[34:74], "value": int(input_hex[74:138], 16)}
+
+# methodId -> (decoder, number of 32-byte words it reads)
+_SELECTOR_DECODERS = {
+    TRANSFER_METHOD_ID: (_decode_transfer, 2),
+    TRANSFER_FROM_METHOD_ID: (_decode_transfer_from, 3),
+    APPROVE_METHOD_ID: (_decode_approve, 2),
+}
 
 def decode_row(input_hex, function_name):
     """
     Decodes the hex input data based on the extracted types from function_name.
+    Known selectors are dispatched on the methodId prefix of the input without parsing the signature.
     Returns a dictionary of decoded values.
     """
-    params = parse_signature(function_name)
-    
     # Replace pd.isna with standard None and type checking
     if input_hex is None or not isinstance(input_hex, str) or len(input_hex) < 10:
         return {}
+
+    fast_path = _SELECTOR_DECODERS.get(input_hex[:10].lower())
+    if fast_path is not None:
+        decoder, n_words = fast_path
+        if len(input_hex) >= 10 + n_words * 64:
+            try:
+                return decoder(input_hex)
+            except ValueError:
+                pass  # Non-hex payload: let the generic path report it per parameter
+
+    params = parse_signature(function_name)
         
     # Strip "0x" + 8 chars of methodId
     hex_data = input_hex[10:]
     decoded = {}
+
+    # Parse the whole payload once; malformed (odd-length / non-hex) calldata falls back to per-word parsing
+    try:
+        raw = bytes.fromhex(hex_data)
+    except ValueError:
+        raw = None
     
     for i, (p_type, p_name) in enumerate(params):
         # Every static ABI parameter is padded to 32 bytes (64 hex characters)
@@ -288,18 +439,19 @@ def decode_row(input_hex, function_name):
             continue
             
         try:
+            word = raw[i * 32:(i + 1) * 32] if raw is not None else bytes.fromhex(chunk)
+
             if 'address' in p_type:
-                # Addresses are 20 bytes (40 hex chars), padded on the left
-                decoded[p_name] = '0x' + chunk[-40:]
+                # Addresses are 20 bytes, padded on the left
+                decoded[p_name] = '0x' + word[-20:].hex()
             elif 'uint' in p_type or 'int' in p_type:
-                # Cast hex to base-16 integer
-                decoded[p_name] = int(chunk, 16)
+                # Big-endian 32-byte word; intN is two's complement
+                decoded[p_name] = int.from_bytes(word, 'big', signed='uint' not in p_type)
             elif 'bool' in p_type:
-                # Cast hex to boolean
-                decoded[p_name] = bool(int(chunk, 16))
+                decoded[p_name] = any(word)
             elif 'bytes' in p_type and '[' not in p_type and 'bytes' != p_type:
                 # Static bytes (e.g. bytes32)
-                decoded[p_name] = '0x' + chunk
+                decoded[p_name] = '0x' + word.hex()
             else:
                 # Dynamic types (string, bytes, arrays) use pointers (offsets). 
                 # For basic normal tx decoding, we store the raw hex offset.
@@ -309,10 +461,74 @@ def decode_row(input_hex, function_name):
             
     return decoded
 
+def abi_word_address(col: str, slot: int) -> pl.Expr:
+    """
+    Polars expression slicing the address stored in 32-byte ABI slot `slot` of a calldata column.
+    Null when the input is too short to contain the slot.
+    """
+    start = 10 + slot * 64
+    return (
+        pl.when(pl.col(col).str.len_bytes() >= start + 64)
+        .then(pl.lit("0x") + pl.col(col).str.slice(start + 24, 40))
+    )
+
+def abi_word_float(col: str, slot: int, signed: bool = False) -> pl.Expr:
+    """
+    Polars expression decoding the uint256 (or int256 when `signed`) stored in 32-byte ABI slot `slot`.
+    A uint256 overflows Int64, so the word is parsed as eight 32-bit limbs and folded into a Float64.
+    Null when the input is too short to contain the slot.
+    """
+    start = 10 + slot * 64
+    limbs = [pl.col(col).str.slice(start + i * 8, 8).str.to_integer(base=16, strict=False).cast(pl.Float64) for i in range(8)]
+
+    value = pl.lit(0.0)
+    for limb in limbs:
+        value = value * 4294967296.0 + limb
+
+    if signed:
+        # Two's complement: fold the inverted limbs and add one, so small negatives stay exact
+        magnitude = pl.lit(0.0)
+        for limb in limbs:
+            magnitude = magnitude * 4294967296.0 + (4294967295.0 - limb)
+        value = pl.when(limbs[0] >= 2147483648.0).then(-(magnitude + 1.0)).otherwise(value)
+
+    return pl.when(pl.col(col).str.len_bytes() >= start + 64).then(value)
+
+def abi_word_hex(col: str, slot: int) -> pl.Expr:
+    """Polars expression returning the raw 64-char hex of ABI slot `slot`, null when the input is too short."""
+    start = 10 + slot * 64
+    return pl.when(pl.col(col).str.len_bytes() >= start + 64).then(pl.col(col).str.slice(start, 64))
+
+def decode_column(df: pl.DataFrame, input_col: str, signature: str) -> pl.DataFrame:
+    """
+    Vectorised decode_row for a column whose rows all share one signature.
+    Adds one column per parameter, named after it (existing columns of the same name are overwritten).
+    uint/int words become Float64 (a uint256 overflows Int64); dynamic types keep their raw pointer word.
+    """
+    exprs = []
+    for i, (p_type, p_name) in enumerate(parse_signature(signature)):
+        word = abi_word_hex(input_col, i)
+        if 'address' in p_type:
+            expr = abi_word_address(input_col, i)
+        elif 'uint' in p_type or 'int' in p_type:
+            expr = abi_word_float(input_col, i, signed='uint' not in p_type)
+        elif 'bool' in p_type:
+            expr = word.str.slice(48, 16).str.to_integer(base=16, strict=False) != 0
+        elif 'bytes' in p_type and '[' not in p_type and 'bytes' != p_type:
+            expr = pl.lit("0x") + word
+        else:
+            expr = pl.lit("Raw/Pointer: 0x") + word
+        exprs.append(expr.alias(p_name))
+
+    return df.with_columns(exprs) if exprs else df
+
 def extract_field(json_str, *keys):
     """Safely extract keys (like 'to', 'from', 'value', 'amount') from a JSON string."""
     if not json_str:
         return None
+    # Most rows carry none of the keys: a substring check is far cheaper than a full parse
+    if not any(k in json_str for k in keys):
+        return None
     try:
         d = json.loads(json_str)
         for k in keys: